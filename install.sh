@@ -1,6 +1,6 @@
 brew install python@3.10
 brew install portaudio
-pip3.10 install numpy pyaudio pyautogui pynput whisper-openai
+pip3.10 install numpy pyaudio pyautogui pyperclip pynput webrtcvad faster-whisper
 
 # where am I located?
 DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" >/dev/null 2>&1 && pwd )"
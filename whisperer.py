@@ -1,17 +1,29 @@
-import json
 import queue
+import re
 import sys
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
+import ctranslate2
 import numpy as np
 import pyaudio
 import pyautogui
-import whisper
+import pyperclip
+from faster_whisper import WhisperModel
 from pynput import keyboard
 
+try:
+    import webrtcvad
+except ImportError:
+    webrtcvad = None
+
 # Configure your desired hotkey
 MODIFIER = keyboard.Key.alt_r
+# Shortcut used to paste transcriptions into the active window
+PASTE_KEYS = ("command", "v") if sys.platform == "darwin" else ("ctrl", "v")
+# pyautogui sleeps 0.1s after every call by default, which is pure lag when pasting
+pyautogui.PAUSE = 0
 
 prompt = ""
 if len(sys.argv) > 1:
@@ -27,72 +39,140 @@ if len(sys.argv) > 1:
 else:
     print("No prompt specified")
 
-# Load the model
-# switch cpu to mps once fixed: https://github.com/pytorch/pytorch/issues/87886
-model = whisper.load_model("small.en", device='cpu')
+# PortAudio's device scan is slow, so run it in the background while the model loads
+audio = None
+audio_ready = threading.Event()
+
+def init_audio():
+    """Create the PyAudio instance used for every recording."""
+    global audio
+    try:
+        audio = pyaudio.PyAudio()
+    finally:
+        audio_ready.set()
+
+threading.Thread(target=init_audio).start()
+
+# Number of recordings that can be transcribed at the same time
+TRANSCRIBE_WORKERS = 2
+
+# Load the model - fp16 on a CUDA GPU if there is one, otherwise int8 weights on the CPU
+# CTranslate2 has no Metal/MPS backend, so Apple Silicon stays on the CPU
+model = None
+if ctranslate2.get_cuda_device_count() > 0:
+    try:
+        model = WhisperModel("small.en", device="cuda", compute_type="float16", num_workers=TRANSCRIBE_WORKERS)
+    except Exception as e:
+        print(f"Couldn't load model on GPU, falling back to CPU: {e}")
+if model is None:
+    model = WhisperModel("small.en", device="cpu", compute_type="int8", num_workers=TRANSCRIBE_WORKERS)
+
+# Options for every transcription - the prompt never changes, so build them once
+TRANSCRIBE_OPTIONS = {"initial_prompt": prompt or None, "vad_filter": True}
 
 # Enable VAD - detects when you stop speaking and starts transcribing that automatically
 use_vad = False
+# Aggressiveness from 0 (least) to 3 (most) at filtering out non-speech
+# Falls back to an adaptive energy threshold if webrtcvad isn't installed
+vad = webrtcvad.Vad(3) if webrtcvad else None
 
 # Global variables
 recording = False
-audio = pyaudio.PyAudio()
 stream = None
-frames = []
-modifier_pressed = False
 modifier_last_pressed = 0
+# Set while the hotkey is up - pasting while it's held would send modifier+v
+modifier_released = threading.Event()
+modifier_released.set()
 audio_queue = queue.Queue()
+transcripts = queue.Queue()
+transcribe_pool = ThreadPoolExecutor(max_workers=TRANSCRIBE_WORKERS)
+workers_free = threading.Semaphore(TRANSCRIBE_WORKERS)
 
 # Audio settings
-CHUNK = 512
+CHUNK = 480  # 30ms - WebRTC VAD only accepts 10, 20 or 30ms frames
 FORMAT = pyaudio.paInt16
 CHANNELS = 1
 RATE = 16000
+MAX_SECONDS = 300
+
+# Capture buffer - allocated once and reused for every recording
+buffer = np.empty(RATE * MAX_SECONDS, dtype=np.int16)
+write_pos = 0
+silence_counter = 0
+peak_energy = 0.0
+
+# Clips that queue up while the model is busy get transcribed together
+BATCH_SIZE = 4
+BATCH_GAP = RATE  # 1s of silence between clips
+
+# Matches annotations like [BLANK_AUDIO] that Whisper emits for non-speech
+BRACKETED = re.compile(r"\[[^\]]*\]")
+
+def is_speech(data):
+    """Check whether a chunk of raw int16 audio contains speech."""
+    global peak_energy
+    if vad is not None:
+        return vad.is_speech(data, RATE)
+    # Threshold is a fraction of the (slowly decaying) loudest frame seen so far
+    # Widen to int32 so clipped -32768 samples don't overflow back to negative
+    avg_volume = np.abs(np.frombuffer(data, dtype=np.int16), dtype=np.int32).mean() / 32768.0
+    peak_energy = max(0.995 * peak_energy, avg_volume)
+    return avg_volume > max(0.15 * peak_energy, 1e-4)
+
+def audio_callback(in_data, frame_count, time_info, status):
+    """Called by PortAudio with each chunk of audio; stores it in the capture buffer."""
+    global write_pos, silence_counter
+    # Flush before the buffer fills up
+    if write_pos + frame_count > len(buffer):
+        process_and_clear_frames()
+    # Check if the current frame contains speech
+    if use_vad and not is_speech(in_data):
+        silence_counter += 1
+
+        # Check if silence duration exceeds the threshold
+        if silence_counter > 20:  # Adjust this value to change the silence threshold
+            silence_counter = 0
+            if write_pos > 0:
+                process_and_clear_frames()
+        return None, pyaudio.paContinue
+    silence_counter = 0
+    buffer[write_pos:write_pos + frame_count] = np.frombuffer(in_data, dtype=np.int16)
+    write_pos += frame_count
+    return None, pyaudio.paContinue
 
 def record_audio():
-    """Record audio from the microphone and store it in frames."""
-    global recording, stream, frames
+    """Start recording from the microphone into the capture buffer."""
+    global recording, stream, write_pos, silence_counter
+    if recording:
+        return
+    # Normally long finished - PyAudio is created while the model loads
+    audio_ready.wait()
+    if audio is None:
+        print("Couldn't initialise PortAudio")
+        return
+    # Reset before opening - the callback can fire as soon as the stream exists
+    write_pos = 0
     silence_counter = 0
-    if not recording:
-        recording = True
+    # This runs inside the hotkey listener, so an exception here would kill it
+    try:
         stream = audio.open(format=FORMAT,
                             channels=CHANNELS,
                             rate=RATE,
                             input=True,
-                            frames_per_buffer=CHUNK)
-        frames = []
-        print("Recording started...")
-
-    while recording:
-        data = stream.read(CHUNK)
-        frame = np.frombuffer(data, dtype=np.int16).astype(np.float32, order='C') / 32768.0
-        if not use_vad:
-            frames.append(frame)
-            continue
-        # Check if the current frame contains speech
-        # definitely need to improve how we do VAD
-        avg_volume = np.mean(np.abs(frame))
-        is_speech = avg_volume > 0.001
-        print(f"Speech: {avg_volume}")
-        if is_speech:
-            silence_counter = 0
-            frames.append(frame)
-        else:
-            silence_counter += 1
-
-            # Check if silence duration exceeds the threshold
-            if silence_counter > 20:  # Adjust this value to change the silence threshold
-                silence_counter = 0
-                if len(frames) > 0:
-                    process_and_clear_frames()
-    else:
-        stop_recording()
+                            frames_per_buffer=CHUNK,
+                            stream_callback=audio_callback)
+    except Exception as e:
+        print(f"Couldn't open microphone: {e}")
+        return
+    recording = True
+    print("Recording started...")
 
 def process_and_clear_frames():
-    global frames
-    audio_array = np.concatenate(frames)
+    global write_pos
+    # Queue a compact int16 copy so the capture buffer can be reused right away
+    audio_array = buffer[:write_pos].copy()
     audio_queue.put(audio_array)
-    frames = []
+    write_pos = 0
 
 def stop_recording():
     global recording, stream
@@ -101,52 +181,119 @@ def stop_recording():
     recording = False
     stream.stop_stream()
     stream.close()
-    if len(frames) > 0:
+    if write_pos > 0:
         process_and_clear_frames()
 
+def next_batch():
+    """Wait for the next clip, then grab any others already queued up behind it."""
+    clips = [audio_queue.get()]
+    while len(clips) < BATCH_SIZE:
+        try:
+            clips.append(audio_queue.get_nowait())
+        except queue.Empty:
+            break
+    return clips
+
+def build_waveform(clips):
+    """Join int16 clips into one float32 waveform with silence between them."""
+    total = sum(len(clip) for clip in clips) + BATCH_GAP * (len(clips) - 1)
+    waveform = np.zeros(total, dtype=np.float32)
+    pos = 0
+    for clip in clips:
+        # Whisper wants float32 in [-1, 1]; convert straight into place
+        np.multiply(clip, 1.0 / 32768.0, out=waveform[pos:pos + len(clip)], dtype=np.float32)
+        pos += len(clip) + BATCH_GAP
+    return waveform
+
+def transcribe(waveform):
+    """Run the model on a float32 waveform and return the raw text."""
+    segments, _ = model.transcribe(waveform, **TRANSCRIBE_OPTIONS)
+    # segments is a generator - decoding happens as we iterate over it
+    return "".join(segment.text for segment in segments)
+
+def process_transcription(text):
+    """Clean up raw model output into text ready to paste."""
+    # Most transcriptions have no annotations, so skip the regex when possible
+    if "[" in text:
+        text = BRACKETED.sub("", text)
+    # Collapse any run of whitespace into a single space
+    text = " ".join(text.split())
+    if not text:
+        return ""
+    # capitalize first letter and add a space at the end
+    return text[0].upper() + text[1:] + " "
+
+def transcribe_clips(clips):
+    """Transcribe a batch of clips and return the text to type."""
+    t0 = time.time()
+    waveform = build_waveform(clips)
+    print(f"Transcribing audio ({len(clips)} clip{'s' if len(clips) > 1 else ''})...")
+    try:
+        transcription = transcribe(waveform)
+    except Exception as e:
+        print(f"Error: {e}")
+        transcription = transcribe(waveform)
+    t1 = time.time()
+    transcribe_duration = t1 - t0
+    orig_duration = len(waveform) / RATE
+    print(f"Audio: {orig_duration:.2f}s, Transcription: {transcribe_duration:.2f}s, Speedup: {orig_duration / transcribe_duration:.2f}x")
+    return process_transcription(transcription)
+
 def process_audio():
-    """Continuously process audio from the queue and transcribe it."""
-    global audio_queue
+    """Continuously take audio from the queue and hand it to a free transcription worker."""
+    while True:
+        # Only pull from the queue once a worker is free so backed up clips get batched
+        workers_free.acquire()
+        clips = next_batch()
+        future = transcribe_pool.submit(transcribe_clips, clips)
+        future.add_done_callback(lambda _: workers_free.release())
+        transcripts.put(future)
+
+def paste(text):
+    """Put text on the clipboard and paste it into the active window."""
+    pyperclip.copy(text)
+    pyautogui.hotkey(*PASTE_KEYS)
+
+def type_transcripts():
+    """Paste finished transcriptions in the order they were recorded."""
     while True:
-        waveform = audio_queue.get()
-        t0 = time.time()
-        print("Transcribing audio...")
+        future = transcripts.get()
         try:
-            result = model.transcribe(waveform, verbose=False, initial_prompt=prompt, fp16=False)
+            transcription = future.result()
         except Exception as e:
             print(f"Error: {e}")
-            result = model.transcribe(waveform, verbose=False, initial_prompt=prompt, fp16=False)
-        # print(json.dumps(result, indent=2))
-        transcription = result["text"].strip()
-        t1 = time.time()
-        transcribe_duration = t1 - t0
-        orig_duration = len(waveform) / RATE
-        print(f"Audio: {orig_duration:.2f}s, Transcription: {transcribe_duration:.2f}s, Speedup: {orig_duration / transcribe_duration:.2f}x")
-        # capitalize first letter and add a space at the end
-        transcription = transcription[0].upper() + transcription[1:] + " "
-        pyautogui.write(transcription)
+            continue
+        if transcription:
+            modifier_released.wait()
+            paste(transcription)
 
 threading.Thread(target=process_audio).start()
+threading.Thread(target=type_transcripts).start()
 
 # Hotkey listener
 def on_press(key):
     global modifier_last_pressed, recording
-    if key == MODIFIER:
-        modifier_last_pressed = time.time()
-        if recording:
-            print("Stopping recording..")
-            stop_recording()
-        else:
-            print("Starting recording..")
-            threading.Thread(target=record_audio).start()
+    # Fires for every keystroke (including our own pastes), so bail out on a single pointer compare
+    if key is not MODIFIER:
+        return
+    modifier_last_pressed = time.time()
+    modifier_released.clear()
+    if recording:
+        print("Stopping recording..")
+        stop_recording()
+    else:
+        print("Starting recording..")
+        record_audio()
 
 def on_release(key):
     global modifier_last_pressed
-    if key == MODIFIER:
-        if time.time() - modifier_last_pressed < 0.5:
-            return
-        print("Stopping recording..")
-        stop_recording()
+    if key is not MODIFIER:
+        return
+    modifier_released.set()
+    if time.time() - modifier_last_pressed < 0.5:
+        return
+    print("Stopping recording..")
+    stop_recording()
 
 if __name__ == "__main__":
     try: